@@ -1,41 +1,279 @@
-from strands import Agent
-from strands.models import BedrockModel
-# for using MCP 
-from strands.tools.mcp import MCPClient
-from mcp.client.streamable_http import streamablehttp_client
+import argparse
+import atexit
+import hashlib
+import json
 import logging
-def main():
-    # Create a BedrockModel
-    bedrock_model = BedrockModel(
-    model_id="us.anthropic.claude-3-7-sonnet-20250219-v1:0",
-    region_name='us-east-1',
-    temperature=0.3,)
-
-    # we will use simple sse connection option 
-    # Connect to an MCP server using SSE transport
-    try:
-        streamable_http_mcp_client = MCPClient(lambda: streamablehttp_client("http://localhost:8000/mcp"))
-    except Exception as e:
-        logging.error(f"Failed to connect to MCP server: {e}")
-        raise
-
-    system_prompt="""
+import os
+import time
+from typing import TYPE_CHECKING, Optional
+from tenacity import retry, stop_after_attempt, wait_exponential
+
+# strands, boto3 and the MCP client are imported when the agent is first built,
+# importing this module (tests, tooling) does not pay for the SDK imports
+if TYPE_CHECKING:
+    from strands import Agent
+
+log = logging.getLogger(__name__)
+
+MODEL_ID = "us.anthropic.claude-3-7-sonnet-20250219-v1:0"
+
+# base URL of the postgresqlperf MCP server, set MCP_URL when it does not run locally (e.g. on Lambda)
+MCP_URL = os.environ.get("MCP_URL", "http://localhost:8000").rstrip("/")
+
+def _sse_transport():
+    from mcp.client.sse import sse_client
+    return sse_client(f"{MCP_URL}/sse")
+
+def _streamable_http_transport():
+    from mcp.client.streamable_http import streamablehttp_client
+    return streamablehttp_client(f"{MCP_URL}/mcp")
+
+# MCP transports the agent can use to connect to the postgresqlperf server
+TRANSPORTS = {
+    "sse": _sse_transport,
+    "http": _streamable_http_transport,
+}
+
+def supports_prompt_cache(model_id: str) -> bool:
+    """
+    Bedrock prompt caching is only available on the Claude models, and adding a
+    cachePoint to other models (or to an inference profile ARN) fails the call.
+    """
+    return "anthropic.claude" in model_id and not model_id.startswith("arn:")
+
+def _has_cache_point(message: dict) -> bool:
+    return any("cachePoint" in block for block in message["content"])
+
+class MessageCachePoints:
+    """
+    strands hook provider that keeps a cache point on the last user messages
+    (the question and then each toolResult message of the tool loop), so every
+    model call reuses the conversation history prefix of the previous call.
+    Older message cache points are removed, Bedrock allows 4 per request and the
+    system prompt and the tools already use 2.
+    """
+    def __init__(self, keep: int = 2):
+        self.keep = keep
+
+    def register_hooks(self, registry, **kwargs) -> None:
+        from strands.hooks import MessageAddedEvent
+        registry.add_callback(MessageAddedEvent, self.on_message_added)
+
+    def on_message_added(self, event) -> None:
+        if event.message["role"] != "user":
+            return
+        user_messages = [message for message in event.agent.messages if message["role"] == "user"]
+        for i, message in enumerate(user_messages):
+            if i >= len(user_messages) - self.keep:
+                if not _has_cache_point(message):
+                    message["content"].append({"cachePoint": {"type": "default"}})
+            elif _has_cache_point(message):
+                message["content"] = [block for block in message["content"] if "cachePoint" not in block]
+
+class LLMCache:
+    """
+    Simple file based response cache, identical (model, system prompt, tools, message)
+    runs return the saved answer instead of calling Bedrock and the MCP tools again.
+    The key knows nothing about the database state, use it only for dev/test/demo runs.
+    """
+    def __init__(self, cache_dir: str = ".llm_cache", ttl: int = 3600):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def cache_key(model_id: str, system_prompt: str, tool_names: list, message: str) -> str:
+        payload = json.dumps({"model": model_id, "system": system_prompt,
+                              "tools": sorted(tool_names), "message": message}, sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key: str) -> Optional[str]:
+        try:
+            with open(self._path(key)) as f:
+                entry = json.load(f)
+            if entry["expires"] < time.time():
+                return None
+            return entry["value"]
+        except (OSError, ValueError, TypeError, KeyError):
+            # missing, unreadable or malformed entries are a cache miss
+            return None
+
+    def set(self, key: str, value: str) -> str:
+        with open(self._path(key), "w") as f:
+            json.dump({"expires": time.time() + self.ttl, "value": value}, f)
+        return value
+
+# keep the system prompt static - any change invalidates the prompt cache.
+# Bedrock only caches a prefix of at least 1,024 tokens on Claude 3.7 Sonnet,
+# the guidance below together with the tool specs gets us over that limit
+SYSTEM_PROMPT = """
     You are database admin agent your task is to help developers 
     with postgresql performance issues you have MCP tools 
     to connect to the database for performance and schema information
-    when  
-    """
-    with streamable_http_mcp_client:
-        tools = streamable_http_mcp_client.list_tools_sync()    
-        # create the agent 
-        agent = Agent(system_prompt=system_prompt,model=bedrock_model,tools=tools)
-        print(agent.model.config)
-        message = """
-        1. find me the top query ?
-        2. what are the tables that have the queries in the top queries by cpu and by time ? 
-        3. can you find me how to improve this query ? 
-        """
-        agent(message)
+    when you need facts about the database always use the tools and do not guess.
+
+    Guidelines for working with the tools:
+    - start from pg_stat_statements based tools to find the expensive queries,
+      use the running time tool for latency and the cpu tool for total load.
+    - use the running queries tool to see what is executing right now,
+      long running or idle in transaction sessions are a common root cause.
+    - before suggesting an index or a rewrite look at the table definition
+      and the table sizes, small tables rarely need an index.
+    - the default schema is public, if a table is not found list the schemas
+      and the tables of the other schemas before giving up.
+    - call a tool once per question, reuse results you already have in the
+      conversation instead of calling the same tool again.
+
+    Guidelines for answering:
+    - explain why a query is slow: sequential scans on large tables, missing
+      or unused indexes, bad join order, functions on indexed columns,
+      implicit casts, large sorts or hashes spilling to disk, n+1 patterns
+      from the application and missing statistics.
+    - when suggesting a rewrite show the original query and the new query,
+      keep the same result set and explain the difference.
+    - when suggesting an index show the full CREATE INDEX CONCURRENTLY
+      statement and mention the write overhead and the disk size it adds.
+    - suggest EXPLAIN (ANALYZE, BUFFERS) commands the developer can run to
+      validate the suggestion, never run data changing statements yourself.
+    - mention configuration changes (work_mem, shared_buffers,
+      random_page_cost, autovacuum settings) only when the evidence points
+      to them and say that they affect the whole server.
+    - if pg_stat_statements is not installed say so and explain how to
+      enable it with shared_preload_libraries and CREATE EXTENSION.
+    - be short and precise, use lists and code blocks, and say clearly
+      when you are not sure about something.
+    """
+
+# the MCP client, its tools and the model are created once per process and reused
+# by every run() call, this skips the MCP handshake and tool discovery on each call
+# and keeps the Bedrock prompt cache (5 minutes TTL) warm between calls. The agent
+# itself is built per run() so every question starts with an empty history
+_BEDROCK = None
+_CLIENT = None
+_TOOLS = None
+
+def get_model():
+    """
+    Return the process wide BedrockModel, its boto3 client (credentials, signer,
+    endpoint resolution) is created once and shared by every agent call.
+    """
+    global _BEDROCK
+    if _BEDROCK is None:
+        from strands.models import BedrockModel
+        _BEDROCK = BedrockModel(
+        model_id=MODEL_ID,
+        region_name='us-east-1',
+        # temperature 0 keeps the answers deterministic so they can be cached
+        temperature=0,
+        # cache the static prefix (tool specs + system prompt) between turns
+        cache_tools="default" if supports_prompt_cache(MODEL_ID) else None,
+        cache_prompt="default" if supports_prompt_cache(MODEL_ID) else None,)
+    return _BEDROCK
+
+@retry(wait=wait_exponential(multiplier=1, max=10), stop=stop_after_attempt(3), reraise=True)
+def _connect(transport: str):
+    """
+    Create and start an MCP client session, MCPClient() is lazy and only connects here.
+    A failed client is not restarted, every attempt uses a new MCPClient.
+    """
+    from strands.tools.mcp import MCPClient
+    client = MCPClient(TRANSPORTS[transport])
+    client.__enter__()
+    return client
+
+def get_tools(transport: str = "http") -> list:
+    """
+    Return the process wide MCP tools, connecting to the MCP server on first use.
+    Args:
+        transport (str): MCP transport used for the first connection, sse or http
+    """
+    global _CLIENT, _TOOLS
+    if _TOOLS is None:
+        # Connect to an MCP server using the selected transport
+        try:
+            client = _connect(transport)
+        except Exception as e:
+            log.error("Failed to connect to MCP server: %s", e)
+            raise
+        _CLIENT = client
+        atexit.register(_CLIENT.__exit__, None, None, None)
+        _TOOLS = _CLIENT.list_tools_sync()
+    return _TOOLS
+
+def get_agent(transport: str = "http", stream_output: bool = True) -> "Agent":
+    """
+    Build a new agent with an empty conversation on top of the shared model and MCP tools.
+    Args:
+        transport (str): MCP transport used for the first connection, sse or http
+        stream_output (bool): Print the streamed answer to stdout while it is generated
+    """
+    from strands import Agent
+    # move the message cache points along the tool loop, only on models that support them
+    hooks = [MessageCachePoints()] if supports_prompt_cache(MODEL_ID) else []
+    # create the agent 
+    agent = Agent(system_prompt=SYSTEM_PROMPT,model=get_model(),tools=get_tools(transport),hooks=hooks,
+                  **({} if stream_output else {"callback_handler": None}))
+    log.debug("model config: %s", agent.model.config)
+    return agent
+
+def run(message: str, cache: Optional[LLMCache] = None, transport: str = "http", stream_output: bool = True) -> str:
+    """
+    Ask the agent a question, when a cache is given answers are served from it when possible.
+    Each call uses a new agent, history from earlier questions is not sent again.
+    """
+    if cache is not None:
+        # the key uses the live tool list so a changed server tool set is a miss,
+        # a hit skips Bedrock and the tool calls but not the MCP tool discovery
+        key = LLMCache.cache_key(MODEL_ID, SYSTEM_PROMPT, [tool.tool_name for tool in get_tools(transport)], message)
+        answer = cache.get(key)
+        if answer is not None:
+            print("(cached answer, up to %d minutes old - run without --cache for live data)" % (cache.ttl // 60))
+            print(answer)
+            return answer
+    agent = get_agent(transport, stream_output)
+    result = agent(message)
+    # cacheReadInputTokens > 0 means the prompt cache was hit
+    log.info("token usage: %s", result.metrics.accumulated_usage)
+    answer = str(result)
+    if cache is not None:
+        cache.set(key, answer)
+    return answer
+
+def handler(event, context):
+    """
+    AWS Lambda entry point, the event carries the question in its message field.
+    Every invocation gets a new agent, warm containers do not share conversation history.
+    """
+    message = event.get("message") if isinstance(event, dict) else None
+    if not isinstance(message, str) or not message.strip():
+        return {"statusCode": 400, "body": json.dumps({"error": "message is required"})}
+    # do not stream every token to stdout (CloudWatch), the answer is in the response
+    answer = run(message, transport=os.environ.get("MCP_TRANSPORT", "http"), stream_output=False)
+    return {"statusCode": 200, "body": json.dumps({"answer": answer})}
+
+def main():
+    parser = argparse.ArgumentParser(description='PostgreSQL performance agent')
+    parser.add_argument('--transport', choices=sorted(TRANSPORTS), default='http',
+                      help='MCP transport used to connect to the server')
+    parser.add_argument('--cache', action='store_true',
+                      help='reuse saved answers of identical runs (dev/test/demo only, answers can be stale)')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    message = """
+    1. find me the top query ?
+    2. what are the tables that have the queries in the top queries by cpu and by time ? 
+    3. can you find me how to improve this query ? 
+    """
+    run(message, cache=LLMCache() if args.cache else None, transport=args.transport)
+
+# on Lambda build the model and MCP client during the init phase, outside
+# the handler, so warm invocations reuse them and only cold starts pay the setup
+if os.environ.get("AWS_LAMBDA_FUNCTION_NAME"):
+    get_model()
+    get_tools(os.environ.get("MCP_TRANSPORT", "http"))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file